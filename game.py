@@ -4,7 +4,7 @@ This script plays a game, as per the json file of the same name.
 
 from cards import CardStack
 import pandas as pd
-from typing import List
+from typing import List, Optional
 
 
 def play_game(gamelog: pd.DataFrame, card_stacks: List[CardStack],
@@ -61,8 +61,27 @@ def game_finished(game_spreadsheet_id: str, players_sheetname: str,
                   card_stacks: List[CardStack], until_no_cards: bool, *args,
                   **kwargs) -> bool:
 
+    player_data = read_player_data(game_spreadsheet_id, players_sheetname)
+    lines_to_print = game_end_lines(player_data, card_stacks, until_no_cards)
+    if lines_to_print is None:
+        return False
+
+    gamelog = add_lines_to_gamelog_and_print_them(lines_to_print, gamelog,
+                                                  gamelog_filepath)
+    return True
+
+
+def read_player_data(game_spreadsheet_id: str,
+                     players_sheetname: str) -> pd.DataFrame:
     url = f"https://docs.google.com/spreadsheets/d/{game_spreadsheet_id}/gviz/tq?tqx=out:csv&sheet={players_sheetname}"
-    player_data = pd.read_csv(url)
+    return pd.read_csv(url)
+
+
+def game_end_lines(player_data: pd.DataFrame, card_stacks: List[CardStack],
+                   until_no_cards: bool) -> Optional[List[str]]:
+    """
+    Returns the lines announcing the end of the game, or None if the game goes on.
+    """
 
     # If playing until no cards and check victory points for winners
     if until_no_cards:
@@ -79,11 +98,8 @@ def game_finished(game_spreadsheet_id: str, players_sheetname: str,
                     'They have to agree to share the victory or no one wins.'
                 ]
 
-            lines_to_print = ['', 'GAME END', '', 'The cards are finished.'
-                              ] + winner_lines
-            gamelog = add_lines_to_gamelog_and_print_them(
-                lines_to_print, gamelog, gamelog_filepath)
-            return True
+            return ['', 'GAME END', '', 'The cards are finished.'
+                    ] + winner_lines
 
     # If 1 or less players have survivors left
     winners = player_data.loc[player_data.survivors > 0]
@@ -96,10 +112,8 @@ def game_finished(game_spreadsheet_id: str, players_sheetname: str,
             lines_to_print = [
                 f'All players are dead and no one wins the game...'
             ]
-        gamelog = add_lines_to_gamelog_and_print_them(
-            ['', 'GAME END', ''] + lines_to_print, gamelog, gamelog_filepath)
-        return True
-    return False
+        return ['', 'GAME END', ''] + lines_to_print
+    return None
 
 
 def deal_card_update_and_save_gamelog(card_stack: CardStack,
@@ -0,0 +1,457 @@
+"""
+This script hosts many games of "Survivors" at once in a single process, as per "game.json" and "card_stacks.json".
+
+Every session has its own CardStacks, gamelog and source of player data, and is driven by an asyncio
+event loop through a line based API read from stdin (default) or from a local TCP port (--port).
+Commands run concurrently, but the turns of a session are played in the order they were sent.
+Commands:
+    new <session> [players] [players_sheetname] [game_spreadsheet_id]
+                                starts a new session, whose player data is read from its own sheet
+                                ("players_<session>" of the spreadsheet in "game.json" by default)
+    next <session>              deals the next card of a session
+    list                        lists the running sessions
+    close <session>             closes a session
+    quit                        stops the host (over TCP it only disconnects the client)
+
+It can also be load tested with simulated players (--load-test), which reports turns per second and
+turn latency percentiles.
+"""
+
+from cards import CardStack
+from game import read_player_data, game_end_lines
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from contextlib import suppress
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+PlayerDataSource = Callable[[], pd.DataFrame]
+
+
+class PlayerDataError(Exception):
+    """
+    The player data of a session couldn't be read or doesn't describe the players.
+    """
+
+
+class SessionGamelog():
+    """
+    Gamelog of a single session. Lines are appended to its html file instead of being kept in memory.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        with open(self.filepath, 'x') as f:
+            f.write('<span style="white-space: pre-line">\n')
+
+    def add_lines(self, lines: List[str]):
+        with open(self.filepath, 'a') as f:
+            f.write(''.join(f'{line}\n' for line in lines))
+
+    def close(self):
+        with open(self.filepath, 'a') as f:
+            f.write('</span>')
+
+
+@dataclass
+class SimulatedPlayers():
+    """
+    Source of player data for load tests: players randomly win points and lose survivors every turn.
+    """
+    players: int
+    survivors: int = 5
+    death_rate: float = 0.05
+    names: List[str] = None
+    points: List[int] = None
+    alive: List[int] = None
+
+    def __post_init__(self):
+        if self.names is None:
+            self.names = [f'player_{p}' for p in range(1, self.players + 1)]
+        if self.points is None:
+            self.points = [0] * self.players
+        if self.alive is None:
+            self.alive = [self.survivors] * self.players
+
+    def __call__(self) -> pd.DataFrame:
+        for p in range(self.players):
+            self.points[p] += random.randint(0, 2)
+            if self.alive[p] and random.random() < self.death_rate:
+                self.alive[p] -= 1
+        return pd.DataFrame({
+            'name': self.names,
+            'points': self.points,
+            'survivors': self.alive
+        })
+
+
+@dataclass
+class GameSession():
+    """
+    One game, dealt card by card the same way "game.play_game" does, but without blocking on input.
+    """
+    session_id: str
+    card_stacks: List[CardStack]
+    gamelog: SessionGamelog
+    player_data_source: PlayerDataSource
+    players: int
+    until_no_cards: bool = True
+    round: int = 1
+    player: int = 0
+    finished: bool = False
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    async def advance(self) -> List[str]:
+        """
+        Checks if the game finished after the last dealt card and, if not, deals the next one
+        (the event card of the round or the card of the next player). Returns the lines added to the gamelog.
+        """
+        # Overlapping "next" commands of the same session are played one after the other
+        async with self.lock:
+            if self.finished:
+                return []
+
+            # Players update their data after each card, so it's checked before dealing the next one
+            if self.round > 1 or self.player > 0:
+                # Player data might come from the network, so it's read outside of the event loop
+                try:
+                    player_data = await asyncio.to_thread(
+                        self.player_data_source)
+                except pd.errors.ParserError as e:
+                    raise PlayerDataError(
+                        f'Could not parse the player data: {e}') from e
+                except Exception as e:
+                    raise PlayerDataError(
+                        f'Could not read the player data: {e}') from e
+                try:
+                    end_lines = game_end_lines(player_data, self.card_stacks,
+                                               self.until_no_cards)
+                except Exception as e:
+                    raise PlayerDataError(
+                        f'Invalid player data: {e!r}') from e
+                if end_lines is not None:
+                    await asyncio.to_thread(self.gamelog.add_lines, end_lines)
+                    await asyncio.to_thread(self.gamelog.close)
+                    self.finished = True
+                    return end_lines
+
+            event_card_stack, player_card_stack = self.card_stacks
+            if self.player == 0:
+                card_stack = event_card_stack
+                premessage = f'\n------ Turn {self.round} ------'
+            else:
+                card_stack = player_card_stack
+                premessage = f'\n> Player {self.player}'
+            card = card_stack.deal_card()
+            lines = [premessage] + card_stack.card_print_strings(card)
+            try:
+                # The disk might be slow, so the gamelog is written outside of the event loop too
+                await asyncio.to_thread(self.gamelog.add_lines, lines)
+            except BaseException:
+                # The card wasn't logged, so it goes back to the stack and the turn can be retried
+                card_stack.dealt_cards.pop()
+                card_stack.cards.append(card)
+                raise
+
+            self.player += 1
+            if self.player > self.players:
+                self.player = 0
+                self.round += 1
+            return lines
+
+
+@dataclass
+class GameHost():
+    """
+    Keeps many independent GameSessions. Card types are read once and shared by all sessions.
+    """
+    card_types: List[pd.DataFrame]
+    gamelog_filepath: str
+    players: int
+    until_no_cards: bool = True
+    game_spreadsheet_id: str = None
+    players_sheetname: str = None
+    sessions: Dict[str, GameSession] = field(default_factory=dict)
+
+    def new_session(
+            self,
+            session_id: str,
+            players: int = None,
+            player_data_source: Optional[PlayerDataSource] = None,
+            players_sheetname: str = None,
+            game_spreadsheet_id: str = None) -> GameSession:
+        if session_id in self.sessions:
+            raise ValueError(f'Session "{session_id}" already exists.')
+        if players is None:
+            players = self.players
+        if players < 1:
+            raise ValueError('a game needs at least 1 player')
+        if player_data_source is None:
+            # Each table keeps its players in its own sheet, so sessions don't share player data
+            if players_sheetname is None:
+                players_sheetname = f'{self.players_sheetname}_{session_id}'
+            if game_spreadsheet_id is None:
+                game_spreadsheet_id = self.game_spreadsheet_id
+            player_data_source = partial(read_player_data,
+                                         game_spreadsheet_id,
+                                         players_sheetname)
+
+        # Gamelogs of earlier sessions with the same id are kept, a suffix is added instead
+        gamelog_path = Path(self.gamelog_filepath)
+        session_gamelog_path = gamelog_path.with_name(
+            f'{gamelog_path.stem}_{session_id}{gamelog_path.suffix}')
+        n = 1
+        while session_gamelog_path.exists():
+            n += 1
+            session_gamelog_path = gamelog_path.with_name(
+                f'{gamelog_path.stem}_{session_id}_{n}{gamelog_path.suffix}')
+        gamelog = SessionGamelog(str(session_gamelog_path))
+        gamelog.add_lines([f'<<<< Starting "survivors" ({session_id}) >>>>'])
+
+        session = GameSession(
+            session_id=session_id,
+            card_stacks=[CardStack(card_types=ct) for ct in self.card_types],
+            gamelog=gamelog,
+            player_data_source=player_data_source,
+            players=players,
+            until_no_cards=self.until_no_cards)
+        self.sessions[session_id] = session
+        return session
+
+    async def close_session(self, session_id: str):
+        session = self.sessions.pop(session_id)
+        # Wait for the turn in flight, so the gamelog isn't closed in the middle of it
+        async with session.lock:
+            if not session.finished:
+                session.finished = True
+                await asyncio.to_thread(session.gamelog.close)
+
+    async def close_all_sessions(self):
+        await asyncio.gather(
+            *(self.close_session(session_id)
+              for session_id in list(self.sessions)))
+
+    async def handle(self, command: str) -> List[str]:
+        """
+        Runs one command of the line based API and returns the lines of its answer.
+        """
+        words = command.split()
+        if not words:
+            return []
+        action, *params = words
+        try:
+            if action == 'new':
+                session_id, *session_params = params
+                if len(session_params) > 3:
+                    raise ValueError('too many parameters')
+                players, players_sheetname, game_spreadsheet_id = (
+                    session_params + [None] * 3)[:3]
+                self.new_session(
+                    session_id,
+                    int(players) if players is not None else None,
+                    players_sheetname=players_sheetname,
+                    game_spreadsheet_id=game_spreadsheet_id)
+                return [f'[{session_id}] Session started.']
+            if action == 'next':
+                session_id, = params
+                session = self.sessions[session_id]
+                # A bad table only gets an error line, the other sessions keep playing
+                try:
+                    lines = await session.advance()
+                except PlayerDataError as e:
+                    return [f'[{session_id}] {e}']
+                if not lines:
+                    return [f'[{session_id}] The game is finished.']
+                return [
+                    f'[{session_id}] {line}'
+                    for line in '\n'.join(lines).split('\n')
+                ]
+            if action == 'list':
+                return [
+                    f'[{s.session_id}] Round {s.round}' +
+                    (' (finished)' if s.finished else '')
+                    for s in self.sessions.values()
+                ]
+            if action == 'close':
+                session_id, = params
+                await self.close_session(session_id)
+                return [f'[{session_id}] Session closed.']
+        except KeyError as e:
+            return [f'Unknown session {e}.']
+        except ValueError as e:
+            return [f'Invalid command "{command.strip()}": {e}']
+        except OSError as e:
+            return [f'Could not write the gamelog: {e}']
+        return [f'Unknown command "{action}".']
+
+    @classmethod
+    def from_json(cls, game_json: str = 'game.json',
+                  card_stacks_json: str = 'card_stacks.json') -> 'GameHost':
+        with open(game_json, 'r') as fp:
+            game_kwargs = json.load(fp)
+        with open(card_stacks_json, 'r') as fp:
+            card_stack_kwargs = json.load(fp)
+        card_types = [
+            CardStack.from_xlsx(**cs_kwargs).card_types
+            for cs_kwargs in card_stack_kwargs
+        ]
+        return cls(card_types=card_types,
+                   gamelog_filepath=game_kwargs['gamelog_filepath'],
+                   players=game_kwargs['players'],
+                   until_no_cards=game_kwargs['until_no_cards'],
+                   game_spreadsheet_id=game_kwargs['game_spreadsheet_id'],
+                   players_sheetname=game_kwargs['players_sheetname'])
+
+
+async def serve_stdin(host: GameHost):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def answer(command: str):
+        print('\n'.join(await host.handle(command)), flush=True)
+
+    # Every command runs in its own task, so a slow table doesn't hold back the others
+    try:
+        while True:
+            command = await loop.run_in_executor(None, sys.stdin.readline)
+            if not command or command.strip() == 'quit':
+                break
+            task = asyncio.create_task(answer(command))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+    finally:
+        await host.close_all_sessions()
+
+
+async def serve_tcp(host: GameHost, port: int):
+
+    async def handle_client(reader: asyncio.StreamReader,
+                            writer: asyncio.StreamWriter):
+        tasks = set()
+        write_lock = asyncio.Lock()
+
+        async def answer(command: str):
+            lines = await host.handle(command)
+            async with write_lock:
+                writer.write(''.join(f'{line}\n' for line in lines).encode())
+                await writer.drain()
+
+        try:
+            while command := (await reader.readline()).decode():
+                if command.strip() == 'quit':
+                    break
+                task = asyncio.create_task(answer(command))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    server = await asyncio.start_server(handle_client, '127.0.0.1', port)
+    print(f'Hosting "survivors" on 127.0.0.1:{port}', flush=True)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await host.close_all_sessions()
+
+
+async def load_test(host: GameHost,
+                    sessions: int,
+                    max_turns: int,
+                    think_time: float = 0.) -> Dict[str, float]:
+    """
+    Plays many sessions concurrently with simulated players and measures the latency of every turn.
+    """
+
+    async def play_session(session: GameSession) -> List[float]:
+        latencies = []
+        while not session.finished and len(latencies) < max_turns:
+            start = time.perf_counter()
+            await session.advance()
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(think_time)
+        return latencies
+
+    tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0]
+    game_sessions = [
+        host.new_session(f'load{s}',
+                         player_data_source=SimulatedPlayers(host.players))
+        for s in range(sessions)
+    ]
+    memory_per_session = (tracemalloc.get_traced_memory()[0] -
+                          memory_before) / sessions
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    session_latencies = await asyncio.gather(
+        *(play_session(s) for s in game_sessions))
+    elapsed = time.perf_counter() - start
+    for s in game_sessions:
+        await host.close_session(s.session_id)
+
+    latencies = pd.Series([l for ls in session_latencies for l in ls]) * 1000
+    return {
+        'sessions': sessions,
+        'turns': len(latencies),
+        'turns_per_second': len(latencies) / elapsed,
+        'latency_p50_ms': latencies.quantile(.5),
+        'latency_p90_ms': latencies.quantile(.9),
+        'latency_p99_ms': latencies.quantile(.99),
+        'memory_per_session_kb': memory_per_session / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port',
+                        type=int,
+                        help='serve the API on this local TCP port')
+    parser.add_argument('--load-test',
+                        type=int,
+                        metavar='SESSIONS',
+                        help='play this many simulated sessions and report')
+    parser.add_argument('--turns',
+                        type=int,
+                        default=100,
+                        help='maximum turns per simulated session')
+    parser.add_argument('--think-time',
+                        type=float,
+                        default=0.,
+                        help='seconds simulated players wait between turns')
+    args = parser.parse_args()
+    if args.load_test is not None and args.load_test < 1:
+        parser.error('--load-test needs at least 1 session')
+
+    host = GameHost.from_json()
+
+    if args.load_test is not None:
+        with tempfile.TemporaryDirectory() as gamelog_dir:
+            host.gamelog_filepath = str(
+                Path(gamelog_dir) / Path(host.gamelog_filepath).name)
+            report = asyncio.run(
+                load_test(host, args.load_test, args.turns, args.think_time))
+        for name, value in report.items():
+            print(f'{name}: {value:.2f}'
+                  if isinstance(value, float) else f'{name}: {value}')
+    elif args.port:
+        asyncio.run(serve_tcp(host, args.port))
+    else:
+        asyncio.run(serve_stdin(host))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Tests of the multi-session game host, driven through its line based API with simulated players.
+"""
+
+import asyncio
+import shutil
+import time
+import pandas as pd
+import pytest
+from host import GameHost, SimulatedPlayers
+
+
+def card_types(name: str, cards: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            'number': [1] * cards,
+            'name': [f'{name} {c}' for c in range(cards)],
+            'rate': [1.] * cards,
+            'description': [f'{name} card {c}' for c in range(cards)]
+        },
+        index=pd.Index(range(1, cards + 1), name='id'))
+
+
+@pytest.fixture
+def gamelog_dir(tmp_path):
+    (tmp_path / 'gamelogs').mkdir()
+    return tmp_path / 'gamelogs'
+
+
+@pytest.fixture
+def host(gamelog_dir) -> GameHost:
+    return GameHost(card_types=[card_types('event', 10),
+                                card_types('player', 20)],
+                    gamelog_filepath=str(gamelog_dir / 'gamelog.html'),
+                    players=2)
+
+
+def test_game_finishes_when_all_players_die(host, gamelog_dir):
+
+    async def play():
+        host.new_session('a', 2, SimulatedPlayers(2,
+                                                  survivors=1,
+                                                  death_rate=1.))
+        return [await host.handle('next a') for _ in range(3)]
+
+    first, second, third = asyncio.run(play())
+    assert '[a] ------ Turn 1 ------' in first
+    assert '[a] GAME END' in second
+    assert third == ['[a] The game is finished.']
+    gamelog = (gamelog_dir / 'gamelog_a.html').read_text()
+    assert gamelog.count('GAME END') == 1
+    assert gamelog.endswith('</span>')
+
+
+def test_game_finishes_when_cards_run_out(host):
+
+    async def play():
+        host.new_session('a', 2, SimulatedPlayers(2, death_rate=0.))
+        return [await host.handle('next a') for _ in range(31)]
+
+    answers = asyncio.run(play())
+    assert any('[a] The cards are finished.' in a for a in answers)
+    assert host.sessions['a'].finished
+
+
+def test_unknown_session(host):
+    assert asyncio.run(host.handle('next x')) == ["Unknown session 'x'."]
+    assert asyncio.run(host.handle('close x')) == ["Unknown session 'x'."]
+
+
+@pytest.mark.parametrize(
+    'command', ['new', 'new a 0', 'new a -3', 'new a two', 'new a 2 s i more'])
+def test_bad_new_params(host, command):
+    answer, = asyncio.run(host.handle(command))
+    assert answer.startswith(f'Invalid command "{command}"')
+    assert not host.sessions
+
+
+def test_existing_session(host):
+    asyncio.run(host.handle('new a'))
+    answer, = asyncio.run(host.handle('new a'))
+    assert answer == 'Invalid command "new a": Session "a" already exists.'
+
+
+def test_reused_session_id_keeps_previous_gamelog(host, gamelog_dir):
+
+    async def play():
+        for _ in range(2):
+            await host.handle('new a')
+            await host.handle('close a')
+
+    asyncio.run(play())
+    assert (gamelog_dir / 'gamelog_a.html').exists()
+    assert (gamelog_dir / 'gamelog_a_2.html').exists()
+
+
+def test_overlapping_next_are_played_in_order(host, gamelog_dir):
+    survivors = [1, 1]
+
+    def slow_players():
+        time.sleep(.05)
+        return pd.DataFrame({
+            'name': ['a', 'b'],
+            'points': [0, 0],
+            'survivors': survivors
+        })
+
+    async def play():
+        session = host.new_session('a', 2, slow_players)
+        await host.handle('next a')
+        dealt = await asyncio.gather(*(host.handle('next a')
+                                       for _ in range(3)))
+        survivors[:] = [0, 0]
+        ended = await asyncio.gather(*(host.handle('next a')
+                                       for _ in range(3)))
+        return session, dealt, ended
+
+    session, dealt, ended = asyncio.run(play())
+    assert [answer[1] for answer in dealt] == [
+        '[a] > Player 1', '[a] > Player 2', '[a] ------ Turn 2 ------'
+    ]
+    assert len(session.card_stacks[0].dealt_cards) == 2
+    assert len(session.card_stacks[1].dealt_cards) == 2
+    assert sum('[a] GAME END' in answer for answer in ended) == 1
+    gamelog = (gamelog_dir / 'gamelog_a.html').read_text()
+    assert gamelog.count('GAME END') == 1
+    assert gamelog.count('</span>') == 1
+
+
+def test_failed_gamelog_write_keeps_the_card(host, gamelog_dir):
+
+    async def play():
+        session = host.new_session('a', 2, SimulatedPlayers(2))
+        shutil.rmtree(gamelog_dir)
+        answers = [await host.handle('next a') for _ in range(3)]
+        return session, answers
+
+    session, answers = asyncio.run(play())
+    assert all(a[0].startswith('Could not write the gamelog') for a in answers)
+    event_card_stack = session.card_stacks[0]
+    assert len(event_card_stack.cards) == 10
+    assert not event_card_stack.dealt_cards
+    assert (session.round, session.player) == (1, 0)
+
+
+def test_player_data_errors_are_reported_per_session(host):
+
+    def broken_players():
+        return pd.DataFrame({'name': ['a', 'b']})
+
+    async def play():
+        host.new_session('a', 2, broken_players)
+        host.new_session('b', 2, SimulatedPlayers(2))
+        await host.handle('next a')
+        await host.handle('next b')
+        return await host.handle('next a'), await host.handle('next b')
+
+    broken, working = asyncio.run(play())
+    assert broken[0].startswith('[a] Invalid player data')
+    assert working[1] == '[b] > Player 1'